@@ -0,0 +1,12 @@
+# Gunicorn settings, loaded automatically when started from this directory:
+#   gunicorn server:app
+import os
+
+# The frontend calls the API on localhost:5000
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+
+# gevent workers multiplex many I/O-bound requests (yfinance, Redis) per process.
+# The worker monkey-patches the standard library before importing the app.
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_connections = 1000
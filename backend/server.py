@@ -1,63 +1,364 @@
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
 import yfinance as yf
 import pandas as pd
-from neuralprophet import NeuralProphet
+import numpy as np
+from statsforecast.models import AutoETS
 from datetime import datetime, timedelta
 import warnings
+from concurrent.futures import Future
 from functools import lru_cache
+import os
+import threading
 import time
+import msgpack
+import orjson
+import redis
+import requests
+from celery import Celery
+from celery.result import AsyncResult
+from celery.signals import task_postrun, worker_process_init
+from celery.utils.log import get_logger
+from uuid import uuid4
 
 warnings.filterwarnings('ignore')
 
+class OrJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, which also serializes numpy values"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 CORS(app)
 
-# Simple in-memory cache
-cache = {}
+# Compress JSON responses, history and prediction arrays shrink a lot
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+Compress(app)
+
+# Redis cache shared by all workers, survives restarts
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+r = redis.Redis.from_url(REDIS_URL)
+
+# Predictions run in separate Celery workers: celery -A server.celery_app worker
+celery_app = Celery('predict', broker=REDIS_URL, backend=REDIS_URL)
+
+# One pooled HTTP session for all yfinance calls, reusing connections and cookies.
+# Responses are not cached here, the app's own Redis caches handle that.
+session = requests.Session()
+
 CACHE_DURATION = 60  # Cache for 60 seconds
+HISTORY_CACHE_DURATION = 3600  # Cache history for 1 hour
+META_CACHE_DURATION = 86400  # Cache company name and currency for 1 day
+PREDICT_CACHE_DURATION = 3600  # Cache predictions for 1 hour
+PREDICT_JOB_TIMEOUT = 300  # Reuse a queued prediction job for up to 5 minutes
+MAX_PREDICT_DAYS = 30  # Longest prediction horizon
+BATCH_SIZE = 20  # Max symbols per yfinance download
+MAX_SYMBOLS = BATCH_SIZE  # Max symbols per /api/stocks request, one token each
+QUOTE_FIELDS = ('symbol', 'price', 'change', 'changePercent')  # Fields in /api/stocks quotes
+
+# Token bucket limiting yfinance calls, only waits once the budget is used up.
+# The bucket lives in Redis so the budget is shared by every web and Celery worker.
+RATE_LIMIT = 2.0  # Requests per second
+RATE_BURST = 2.0  # Max tokens saved up while idle
+
+# Refills the bucket, reserves tokens and returns how long the caller has to wait
+_rate_script = r.register_script("""
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate) - tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+if tokens < 0 then
+    return tostring(-tokens / rate)
+end
+return '0'
+""")
+
+def _rate_limit(calls=1):
+    """Block until the rate limiter allows another calls yfinance requests"""
+    # Go into debt on the shared bucket and sleep until our tokens have refilled
+    wait = float(_rate_script(keys=['yf_rate_limit'], args=[RATE_LIMIT, RATE_BURST, calls]))
+    
+    if wait > 0:
+        time.sleep(wait)
+
+def forecast_prices(y, days):
+    """Fit exponential smoothing with weekly (5 trading day) seasonality and forecast days ahead"""
+    model = AutoETS(season_length=5)
+    model.fit(y)
+    return model.predict(h=days)['mean']
+
+# Only Celery workers forecast, so only they compile numba, once per worker process
+@worker_process_init.connect
+def _warm(**kwargs):
+    """Run a dummy forecast so numba compiles before the first real prediction"""
+    try:
+        forecast_prices(np.linspace(1, 2, 30), 7)
+    except Exception as e:
+        get_logger(__name__).warning("Forecast warm-up failed: %s", e)
+
+def _pack_default(obj):
+    """Store numpy arrays and scalars as plain msgpack lists and numbers"""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f'Cannot cache value of type {type(obj).__name__}')
+
+def cache_dumps(data):
+    """Serialize a value for Redis"""
+    return msgpack.packb(data, use_bin_type=True, default=_pack_default)
+
+def cache_loads(blob):
+    """Deserialize a value stored with cache_dumps"""
+    return msgpack.unpackb(blob, raw=False)
+
+def set_cached(key, data, ttl=CACHE_DURATION):
+    """Store a value in the cache with a TTL"""
+    r.setex(key, ttl, cache_dumps(data))
+
+# Fetches in progress, so concurrent misses on the same key share one upstream call
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def get_cached_or_fetch(key, fetch_func, *args, ttl=CACHE_DURATION):
+    """Return the cached value for key, or fetch and store it with a TTL"""
+    cached = r.get(key)
+    if cached is not None:
+        return cache_loads(cached)
+    
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _inflight[key] = future
+    
+    # Another request is already fetching this key, wait for its result
+    if not is_owner:
+        return future.result()
+    
+    try:
+        # A previous owner may have stored the value after our first lookup
+        cached = r.get(key)
+        if cached is not None:
+            data = cache_loads(cached)
+        else:
+            # Fetch new data
+            data = fetch_func(*args)
+            set_cached(key, data, ttl)
+        future.set_result(data)
+        return data
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+def format_dates(index):
+    """Format a DatetimeIndex as YYYY-MM-DD strings without a per-element strftime"""
+    # Drop the timezone first so dates are in exchange time, not UTC
+    days = index.tz_localize(None).values.astype('datetime64[D]')
+    return np.datetime_as_string(days).tolist()
+
+def price_and_prev_close(hist):
+    """Latest close and the close before it, or today's open when there is only one bar"""
+    price = float(hist['Close'].iat[-1])
+    prev = float(hist['Close'].iat[-2]) if len(hist) > 1 else float(hist['Open'].iat[-1])
+    return price, prev
+
+def fetch_stock(symbol):
+    """Fetch the current quote for symbol from yfinance"""
+    stock = yf.Ticker(symbol, session=session)
+    
+    # One chart request covers both today's close and the previous close
+    _rate_limit()
+    hist = stock.history(period='5d')
+    
+    if hist.empty:
+        return None
+    
+    price, prev = price_and_prev_close(hist)
+    
+    # Name and currency rarely change, so only hit the heavy .info call once a day.
+    # Unknown symbols returned above, so they never pay for it.
+    def fetch_meta():
+        _rate_limit()
+        info = stock.info
+        return {
+            'name': info.get('longName', symbol),
+            'currency': info.get('currency', 'USD')
+        }
+    
+    meta = get_cached_or_fetch(f'meta_{symbol}', fetch_meta, ttl=META_CACHE_DURATION)
+    
+    diff = price - prev
+    pct = diff / prev * 100.0 if prev else 0.0
+    
+    return {
+        'symbol': symbol.upper(),
+        'name': meta['name'],
+        'price': round(price, 2),
+        'currency': meta['currency'],
+        'change': round(diff, 2),
+        'changePercent': round(pct, 2)
+    }
+
+def fetch_history(symbol, period):
+    """Fetch price history for symbol from yfinance"""
+    _rate_limit()
+    stock = yf.Ticker(symbol, session=session)
+    hist = stock.history(period=period)
+    
+    if hist.empty:
+        return None
+    
+    # Keep prices and volumes as numpy arrays, the cache and jsonify serialize them directly
+    return {
+        'dates': format_dates(hist.index),
+        'prices': hist['Close'].to_numpy(np.float64).round(2),
+        'volumes': hist['Volume'].to_numpy(np.int64)
+    }
+
+# Per-worker L1 cache in front of Redis for hot symbols. The time bucket is part of
+# the key, so entries stop being used when the bucket rolls over.
+L1_CACHE_SIZE = 256
+
+def l1_bucket(ttl):
+    """Current L1 time bucket for values cached in Redis for ttl seconds"""
+    # Buckets last half the Redis TTL, so an L1 hit is at most 1.5x the TTL old
+    return int(time.time() // (ttl / 2))
+
+@lru_cache(maxsize=L1_CACHE_SIZE)
+def get_stock_l1(symbol, bucket):
+    """Current quote for symbol, cached in process for the given time bucket"""
+    return get_cached_or_fetch(f'stock_{symbol}', fetch_stock, symbol)
+
+@lru_cache(maxsize=L1_CACHE_SIZE)
+def get_history_l1(symbol, period, bucket):
+    """Price history for symbol, cached in process for the given time bucket"""
+    return get_cached_or_fetch(f'history_{symbol}_{period}', fetch_history, symbol, period, ttl=HISTORY_CACHE_DURATION)
+
+def fetch_quotes(chunk):
+    """Fetch current quotes for a chunk of symbols in one yfinance download"""
+    # download sends one chart request per ticker, so each symbol costs a token
+    _rate_limit(len(chunk))
+    data = yf.download(chunk, period='5d', group_by='ticker', threads=True, progress=False, session=session)
+    
+    quotes = {}
+    for symbol in chunk:
+        if symbol not in data.columns.get_level_values(0):
+            quotes[symbol] = None
+            continue
+        
+        hist = data[symbol].dropna(subset=['Open', 'Close'])
+        if hist.empty:
+            quotes[symbol] = None
+            continue
+        
+        price, prev = price_and_prev_close(hist)
+        diff = price - prev
+        pct = diff / prev * 100.0 if prev else 0.0
+        
+        quotes[symbol] = {
+            'symbol': symbol,
+            'price': round(price, 2),
+            'change': round(diff, 2),
+            'changePercent': round(pct, 2)
+        }
+    return quotes
+
+def fetch_stocks(symbols):
+    """Fetch current quotes for symbols, reusing per-symbol cache entries"""
+    # /api/stock entries hold the same price fields, so reuse them before batch quotes
+    stock_entries = r.mget([f'stock_{s}' for s in symbols])
+    quote_entries = r.mget([f'quote_{s}' for s in symbols])
+    
+    quotes = {}
+    missing = []
+    for symbol, stock_entry, quote_entry in zip(symbols, stock_entries, quote_entries):
+        if stock_entry is not None:
+            # Drop name and currency so every quote has the same fields
+            stock = cache_loads(stock_entry)
+            quotes[symbol] = {field: stock[field] for field in QUOTE_FIELDS} if stock is not None else None
+        elif quote_entry is not None:
+            quotes[symbol] = cache_loads(quote_entry)
+        else:
+            missing.append(symbol)
+    
+    for i in range(0, len(missing), BATCH_SIZE):
+        chunk = missing[i:i + BATCH_SIZE]
+        fetched = fetch_quotes(chunk)
+        for symbol in chunk:
+            quotes[symbol] = fetched[symbol]
+            set_cached(f'quote_{symbol}', fetched[symbol])
+    
+    return {symbol: quotes[symbol] for symbol in symbols}
 
-def get_cached_or_fetch(key, fetch_func, *args):
-    """Simple caching mechanism"""
-    current_time = time.time()
+def fetch_prediction(symbol, days):
+    """Forecast the next days closing prices for symbol"""
+    # Get historical data
+    _rate_limit()
+    stock = yf.Ticker(symbol, session=session)
+    hist = stock.history(period='3mo')
+    
+    if hist.empty or len(hist) < 30:
+        return None
+    
+    # AutoETS works on a plain float array, no DataFrame needed
+    y = hist['Close'].to_numpy(dtype=np.float64)
+    current_price = float(y[-1])
+    
+    forecast = forecast_prices(y, days)
     
-    if key in cache:
-        data, timestamp = cache[key]
-        if current_time - timestamp < CACHE_DURATION:
-            return data
+    # Forecasts are for the following business days
+    future_dates = pd.date_range(hist.index[-1] + pd.Timedelta('1D'), periods=days, freq='B')
     
-    # Fetch new data
-    data = fetch_func(*args)
-    cache[key] = (data, current_time)
-    return data
+    result = {
+        'symbol': symbol.upper(),
+        'predictions': {
+            'dates': format_dates(future_dates),
+            'prices': forecast.round(2).tolist()
+        },
+        'current_price': round(current_price, 2),
+        'predicted_change': round(forecast[-1] - current_price, 2),
+        'predicted_change_percent': round(((forecast[-1] - current_price) / current_price * 100), 2)
+    }
+    
+    return result
+
+@celery_app.task
+def train_and_predict(symbol, days):
+    """Celery task computing a prediction, through the shared cache"""
+    return get_cached_or_fetch(f'predict_{symbol}_{days}', fetch_prediction, symbol, days, ttl=PREDICT_CACHE_DURATION)
+
+@task_postrun.connect(sender=train_and_predict)
+def _finish_prediction_job(task_id=None, args=None, **kwargs):
+    """Clear a finished job's keys, after Celery has stored its result"""
+    # Lets the next request queue a fresh job, e.g. after this one failed
+    symbol, days = args
+    r.delete(f'predict_job_{symbol}_{days}', f'predict_pending_{task_id}')
 
 @app.route('/api/stock/<symbol>', methods=['GET'])
 def get_stock_data(symbol):
     """Get current stock data with caching"""
     try:
-        def fetch_stock():
-            # Add a small delay to avoid rate limits
-            time.sleep(0.5)
-            
-            stock = yf.Ticker(symbol)
-            info = stock.info
-            hist = stock.history(period='1d')
-            
-            if hist.empty:
-                return None
-            
-            current_price = hist['Close'].iloc[-1]
-            
-            return {
-                'symbol': symbol.upper(),
-                'name': info.get('longName', symbol),
-                'price': round(current_price, 2),
-                'currency': info.get('currency', 'USD'),
-                'change': round(hist['Close'].iloc[-1] - hist['Open'].iloc[0], 2) if len(hist) > 0 else 0,
-                'changePercent': round(((hist['Close'].iloc[-1] - hist['Open'].iloc[0]) / hist['Open'].iloc[0] * 100), 2) if len(hist) > 0 else 0
-            }
-        
-        data = get_cached_or_fetch(f'stock_{symbol}', fetch_stock)
+        # Cache keys use upper-case symbols, so /api/stocks can reuse these entries
+        symbol = symbol.upper()
+        data = get_stock_l1(symbol, l1_bucket(CACHE_DURATION))
         
         if data is None:
             return jsonify({'error': 'Stock not found'}), 404
@@ -70,28 +371,35 @@ def get_stock_data(symbol):
             return jsonify({'error': 'Rate limit exceeded. Please try again in a minute.'}), 429
         return jsonify({'error': error_msg}), 500
 
+@app.route('/api/stocks', methods=['GET'])
+def get_stocks_data():
+    """Get current data for several stocks using batched downloads"""
+    try:
+        symbols = [s.strip().upper() for s in request.args.get('symbols', '').split(',') if s.strip()]
+        symbols = list(dict.fromkeys(symbols))
+        
+        if not symbols:
+            return jsonify({'error': 'No symbols provided'}), 400
+        
+        if len(symbols) > MAX_SYMBOLS:
+            return jsonify({'error': f'At most {MAX_SYMBOLS} symbols per request'}), 400
+        
+        data = get_cached_or_fetch(f'stocks_{",".join(sorted(symbols))}', fetch_stocks, symbols)
+        
+        return jsonify(data)
+        
+    except Exception as e:
+        error_msg = str(e)
+        if '429' in error_msg:
+            return jsonify({'error': 'Rate limit exceeded. Please try again in a minute.'}), 429
+        return jsonify({'error': error_msg}), 500
+
 @app.route('/api/history/<symbol>', methods=['GET'])
 def get_stock_history(symbol):
     """Get historical stock data with caching"""
     try:
         period = request.args.get('period', '1mo')
-        cache_key = f'history_{symbol}_{period}'
-        
-        def fetch_history():
-            time.sleep(0.5)
-            stock = yf.Ticker(symbol)
-            hist = stock.history(period=period)
-            
-            if hist.empty:
-                return None
-            
-            return {
-                'dates': hist.index.strftime('%Y-%m-%d').tolist(),
-                'prices': hist['Close'].round(2).tolist(),
-                'volumes': hist['Volume'].tolist()
-            }
-        
-        data = get_cached_or_fetch(cache_key, fetch_history)
+        data = get_history_l1(symbol, period, l1_bucket(HISTORY_CACHE_DURATION))
         
         if data is None:
             return jsonify({'error': 'No historical data found'}), 404
@@ -106,59 +414,66 @@ def get_stock_history(symbol):
 
 @app.route('/api/predict/<symbol>', methods=['GET'])
 def predict_stock(symbol):
-    """Predict future stock prices using NeuralProphet"""
+    """Predict future stock prices using exponential smoothing (AutoETS)"""
     try:
-        days = int(request.args.get('days', 7))
+        days = request.args.get('days', 7, type=int)
         
-        # Get historical data
-        time.sleep(0.5)
-        stock = yf.Ticker(symbol)
-        hist = stock.history(period='3mo')
+        if days is None or not 1 <= days <= MAX_PREDICT_DAYS:
+            return jsonify({'error': f'days must be between 1 and {MAX_PREDICT_DAYS}'}), 400
         
-        if hist.empty or len(hist) < 30:
-            return jsonify({'error': 'Insufficient historical data'}), 400
+        # Serve a cached prediction straight away, otherwise hand it to a worker
+        cached = r.get(f'predict_{symbol}_{days}')
+        if cached is not None:
+            data = cache_loads(cached)
+            
+            if data is None:
+                return jsonify({'error': 'Insufficient historical data'}), 400
+            
+            return jsonify(data)
         
-        # Prepare data for NeuralProphet
-        df = pd.DataFrame({
-            'ds': hist.index,
-            'y': hist['Close']
-        })
-        df['ds'] = pd.to_datetime(df['ds'])
-        df = df.reset_index(drop=True)
-        
-        # Train model
-        model = NeuralProphet(
-            n_forecasts=days,
-            n_lags=14,
-            yearly_seasonality=False,
-            weekly_seasonality=True,
-            daily_seasonality=False,
-            epochs=50,
-            learning_rate=0.1
-        )
-        
-        # Fit model
-        model.fit(df, freq='D', validation_df=None, progress=None)
-        
-        # Make predictions
-        future = model.make_future_dataframe(df, periods=days, n_historic_predictions=len(df))
-        forecast = model.predict(future)
-        
-        # Get only future predictions
-        predictions = forecast[forecast['ds'] > df['ds'].max()]
+        # Reuse the job already queued for this prediction, so identical requests share one
+        job_key = f'predict_job_{symbol}_{days}'
+        job_id = str(uuid4())
         
-        result = {
-            'symbol': symbol.upper(),
-            'predictions': {
-                'dates': predictions['ds'].dt.strftime('%Y-%m-%d').tolist(),
-                'prices': predictions['yhat1'].round(2).tolist()
-            },
-            'current_price': round(hist['Close'].iloc[-1], 2),
-            'predicted_change': round(predictions['yhat1'].iloc[-1] - hist['Close'].iloc[-1], 2),
-            'predicted_change_percent': round(((predictions['yhat1'].iloc[-1] - hist['Close'].iloc[-1]) / hist['Close'].iloc[-1] * 100), 2)
-        }
+        # Mark the id as queued first, so /api/predict/result can tell it from unknown ids
+        r.setex(f'predict_pending_{job_id}', PREDICT_JOB_TIMEOUT, 1)
         
-        return jsonify(result)
+        while True:
+            if r.set(job_key, job_id, nx=True, ex=PREDICT_JOB_TIMEOUT):
+                train_and_predict.apply_async((symbol, days), task_id=job_id)
+                return jsonify({'job_id': job_id}), 202
+            
+            existing = r.get(job_key)
+            if existing is not None:
+                return jsonify({'job_id': existing.decode()}), 202
+            
+            # The previous job cleared its key between our SET and GET, try again
+        
+    except Exception as e:
+        error_msg = str(e)
+        if '429' in error_msg:
+            return jsonify({'error': 'Rate limit exceeded. Please try again in a minute.'}), 429
+        return jsonify({'error': error_msg}), 500
+
+@app.route('/api/predict/result/<job_id>', methods=['GET'])
+def get_prediction_result(job_id):
+    """Get the result of a prediction job started by /api/predict"""
+    try:
+        task = AsyncResult(job_id, app=celery_app)
+        
+        # Celery reports PENDING for unknown and expired ids too
+        if not task.ready():
+            if not r.exists(f'predict_pending_{job_id}'):
+                return jsonify({'error': 'Unknown or expired prediction job'}), 404
+            
+            return jsonify({'status': 'pending'}), 202
+        
+        data = task.get()
+        
+        if data is None:
+            return jsonify({'error': 'Insufficient historical data'}), 400
+        
+        return jsonify(data)
         
     except Exception as e:
         error_msg = str(e)
@@ -170,8 +485,8 @@ def predict_stock(symbol):
 def search_stocks(query):
     """Search for stock symbols"""
     try:
-        time.sleep(0.5)
-        ticker = yf.Ticker(query)
+        _rate_limit()
+        ticker = yf.Ticker(query, session=session)
         info = ticker.info
         
         if 'symbol' not in info:
@@ -193,7 +508,9 @@ if __name__ == '__main__':
     print("Starting Flask server on http://localhost:5000")
     print("API Endpoints:")
     print("  GET /api/stock/<symbol> - Get current stock data")
+    print("  GET /api/stocks?symbols=AAPL,MSFT - Get current data for several stocks")
     print("  GET /api/history/<symbol>?period=1mo - Get historical data")
-    print("  GET /api/predict/<symbol>?days=7 - Get price predictions")
+    print("  GET /api/predict/<symbol>?days=7 - Get price predictions (starts a job if not cached)")
+    print("  GET /api/predict/result/<job_id> - Get the result of a prediction job")
     print("  GET /api/search/<query> - Search for stocks")
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app.run(port=5000)
\ No newline at end of file
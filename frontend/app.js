@@ -162,8 +162,7 @@ async function showPrediction() {
     btn.textContent = 'Loading prediction...';
     
     try {
-        const response = await fetch(`${API_URL}/predict/${currentSymbol}?days=7`);
-        const data = await response.json();
+        const { response, data } = await fetchPrediction(currentSymbol, 7);
         
         if (response.ok) {
             // Fetch historical data first
@@ -200,6 +199,28 @@ async function showPrediction() {
     }
 }
 
+// Predictions not in the cache run as a background job, poll until it finishes
+async function fetchPrediction(symbol, days) {
+    let response = await fetch(`${API_URL}/predict/${symbol}?days=${days}`);
+    let data = await response.json();
+    
+    for (let attempt = 0; response.status === 202; attempt++) {
+        if (attempt >= 60) {
+            throw new Error('Prediction timed out');
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        response = await fetch(`${API_URL}/predict/result/${data.job_id}`);
+        const result = await response.json();
+        
+        if (response.status !== 202) {
+            data = result;
+        }
+    }
+    
+    return { response, data };
+}
+
 function drawChart(labels, data, title, splitIndex = null) {
     const ctx = document.getElementById('stockChart').getContext('2d');
     